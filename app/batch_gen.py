@@ -0,0 +1,212 @@
+import asyncio
+import json
+import logging
+from typing import Optional
+
+import pybase64
+from cachetools import TTLCache
+
+from app.image_gen import client
+from app.supabase_db import claim_batch, get_batch_results, release_batch_claim, save_batch_results
+from app.supabase_storage import upload_images_bulk
+
+logger = logging.getLogger(__name__)
+
+# Batch calls don't go through call_openai, so they keep the SDK's default retries
+batch_client = client.with_options(max_retries=2)
+
+# Status of completed batches, whose images have already been uploaded to
+# storage, so later polls to this worker make no API or database calls
+_completed_batches = TTLCache(maxsize=256, ttl=24 * 60 * 60)
+
+# Result collection in progress, keyed by batch ID, so concurrent polls share it
+_collecting: dict[str, asyncio.Task] = {}
+
+BATCH_ENDPOINT = "/v1/images/generations"
+
+async def submit_batch(
+    prompts: list[str],
+    size: str = "1024x1024",
+    background: str = "auto",
+    quality: str = "auto",
+    output_format: str = "png",
+) -> str:
+    """
+    Submit a set of prompts as an OpenAI Batch API job.
+
+    Batch jobs are billed at a discount and do not count against the
+    synchronous rate limits, at the cost of completing within 24 hours.
+
+    Args:
+        prompts: The text prompts to generate images for
+        size: The size of the output images
+        background: Background style preference
+        quality: Image quality setting
+        output_format: Output image format
+
+    Returns:
+        The ID of the created batch
+    """
+    body = {"model": "gpt-image-1", "n": 1, "output_format": output_format}
+    if size != "auto":
+        body["size"] = size
+    if background != "auto":
+        body["background"] = background
+    if quality != "auto":
+        body["quality"] = quality
+
+    # One request per line, matched back to its prompt by custom_id
+    lines = [
+        json.dumps({
+            "custom_id": f"prompt-{idx}",
+            "method": "POST",
+            "url": BATCH_ENDPOINT,
+            "body": {**body, "prompt": prompt},
+        })
+        for idx, prompt in enumerate(prompts)
+    ]
+    batch_input = "\n".join(lines).encode("utf-8")
+
+    input_file = await batch_client.files.create(file=("batch.jsonl", batch_input), purpose="batch")
+    batch = await batch_client.batches.create(
+        input_file_id=input_file.id,
+        endpoint=BATCH_ENDPOINT,
+        completion_window="24h",
+    )
+    logger.info("Submitted batch %s with %d prompts", batch.id, len(prompts))
+    return batch.id
+
+async def _read_jsonl(file_id) -> list[dict]:
+    """Download a batch file and parse its JSON lines; a missing file has none."""
+    if not file_id:
+        return []
+    content = await batch_client.files.content(file_id)
+    return [json.loads(line) for line in content.text.splitlines() if line.strip()]
+
+async def _collect_results(batch) -> list[dict]:
+    """
+    Download a completed batch's output and errors and upload its images to storage.
+
+    Args:
+        batch: The completed batch
+
+    Returns:
+        Per-prompt results ordered as submitted, with the stored image's
+        filename and public_url in place of the base64 data
+    """
+    # Successful requests are in the output file and failed ones only in the
+    # error file; the input file holds the prompt and size of each custom_id
+    outputs, errors, batch_input = await asyncio.gather(
+        _read_jsonl(batch.output_file_id),
+        _read_jsonl(batch.error_file_id),
+        _read_jsonl(batch.input_file_id),
+    )
+    requests = {record["custom_id"]: record["body"] for record in batch_input}
+
+    results = []
+    images = []
+    for record in outputs + errors:
+        response = record.get("response") or {}
+        body = response.get("body") or {}
+        result = {
+            "custom_id": record["custom_id"],
+            "prompt": requests.get(record["custom_id"], {}).get("prompt"),
+            "status_code": response.get("status_code"),
+            # Failed requests report their API error in the response body
+            "error": record.get("error") or body.get("error"),
+        }
+        results.append(result)
+        data = body.get("data")
+        if response.get("status_code") == 200 and data:
+            images.append((result, data[0]["b64_json"]))
+
+    all_image_bytes = await asyncio.gather(
+        *[asyncio.to_thread(pybase64.b64decode, b64_image) for _, b64_image in images]
+    )
+    uploads = await upload_images_bulk(
+        [
+            {
+                "image_bytes": image_bytes,
+                "folder": "generated",
+                "prompt": result["prompt"],
+                "size": requests.get(result["custom_id"], {}).get("size", "1024x1024"),
+            }
+            for (result, _), image_bytes in zip(images, all_image_bytes)
+        ],
+        return_exceptions=True,
+    )
+    for (result, _), upload in zip(images, uploads):
+        if isinstance(upload, Exception):
+            logger.error("Error storing batch image %s: %s", result["custom_id"], upload)
+            result["upload_error"] = str(upload)
+        else:
+            result["filename"], result["public_url"] = upload
+
+    # Output lines are not guaranteed to follow input order
+    results.sort(key=lambda r: int(r["custom_id"].split("-")[1]))
+    return results
+
+async def _collect_once(batch) -> Optional[list[dict]]:
+    """
+    Collect a completed batch unless another worker has claimed it.
+
+    Workers don't share memory, so the claim and the finished results live in
+    the database; only the claiming worker uploads the batch's images.
+
+    Returns:
+        The per-prompt results, or None if another worker is collecting them
+    """
+    if not await claim_batch(batch.id):
+        return None
+    try:
+        results = await _collect_results(batch)
+    except Exception:
+        await release_batch_claim(batch.id)
+        raise
+    await save_batch_results(batch.id, results)
+    return results
+
+async def get_batch_status(batch_id: str) -> dict:
+    """
+    Get the status of a batch job, including its results once completed.
+
+    The first poll after completion, on any worker, uploads the generated
+    images to storage and stores the results for the other workers.
+
+    Args:
+        batch_id: The ID returned by submit_batch
+
+    Returns:
+        dict with the batch status, request counts and, when completed,
+        the per-prompt results ordered as submitted, or results_pending
+        while another worker is still collecting them
+    """
+    cached = _completed_batches.get(batch_id)
+    if cached is not None:
+        return cached
+
+    batch = await batch_client.batches.retrieve(batch_id)
+    status = {
+        "id": batch.id,
+        "status": batch.status,
+        "request_counts": batch.request_counts,
+    }
+
+    if batch.status == "completed" and (batch.output_file_id or batch.error_file_id):
+        results = await get_batch_results(batch_id)
+        if results is None:
+            task = _collecting.get(batch_id)
+            if task is None:
+                task = asyncio.create_task(_collect_once(batch))
+                _collecting[batch_id] = task
+                task.add_done_callback(lambda _: _collecting.pop(batch_id, None))
+            # Shielded so one poll disconnecting doesn't abort the uploads for the others
+            results = await asyncio.shield(task)
+
+        if results is None:
+            status["results_pending"] = True
+        else:
+            status["results"] = results
+            _completed_batches[batch_id] = status
+
+    return status
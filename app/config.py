@@ -10,4 +10,21 @@ OPENAI_ORG_ID = os.getenv("OPENAI_ORG_ID")
 # Supabase configuration
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
-SUPABASE_BUCKET_NAME = os.getenv("SUPABASE_BUCKET_NAME", "ad-images")
\ No newline at end of file
+SUPABASE_BUCKET_NAME = os.getenv("SUPABASE_BUCKET_NAME", "ad-images")
+# Maximum number of concurrent uploads/deletes against Supabase Storage
+SUPABASE_UPLOAD_CONCURRENCY = int(os.getenv("SUPABASE_UPLOAD_CONCURRENCY", "8"))
+# Uploads at least this large use the resumable (TUS) endpoint in 6 MB chunks
+SUPABASE_RESUMABLE_THRESHOLD = int(os.getenv("SUPABASE_RESUMABLE_THRESHOLD", 6 * 1024 * 1024))
+# Largest image sent to Supabase Storage; bigger ones are rejected before uploading
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", 10 * 1024 * 1024))
+# Re-encode images as WebP before storing them; far smaller than the PNGs the image API returns
+STORE_AS_WEBP = os.getenv("STORE_AS_WEBP", "true").lower() == "true"
+
+# Largest request body accepted by the API, checked before the body is read
+MAX_REQUEST_BYTES = int(os.getenv("MAX_REQUEST_BYTES", 25 * 1024 * 1024))
+
+# Most prompts accepted by one /generate-image-batch/ request
+MAX_BATCH_PROMPTS = int(os.getenv("MAX_BATCH_PROMPTS", 10))
+
+# Serve /static from the app; disable when a reverse proxy serves it instead
+SERVE_STATIC_FILES = os.getenv("SERVE_STATIC_FILES", "true").lower() == "true"
\ No newline at end of file
@@ -1,15 +1,128 @@
-import base64
+import asyncio
+import hashlib
 import io
+import json
+import logging
 from typing import Optional
 
+import httpx
+import pybase64
+from cachetools import TTLCache
 from fastapi import UploadFile, HTTPException
-from openai import OpenAI
+from openai import AsyncOpenAI
 from PIL import Image
 
 from app.config import OPENAI_API_KEY
+from app.openai_limiter import call_openai
 
-# Initialize OpenAI client
-client = OpenAI(api_key=OPENAI_API_KEY)
+logger = logging.getLogger(__name__)
+
+# Initialize OpenAI client on a shared, long-lived connection pool so calls
+# reuse keep-alive connections instead of handshaking each time
+http_client = httpx.AsyncClient(
+    http2=True,
+    limits=httpx.Limits(max_connections=200, max_keepalive_connections=50, keepalive_expiry=60),
+    # Image generations and edits can take minutes; only connecting is kept short
+    timeout=httpx.Timeout(600.0, connect=5.0),
+)
+# Retries are handled by call_openai, so the SDK's own retries are disabled
+client = AsyncOpenAI(api_key=OPENAI_API_KEY, http_client=http_client, max_retries=0)
+
+# Style descriptions keyed by a hash of the reference image bytes, so
+# re-uploading the same reference skips the vision call
+style_cache = TTLCache(maxsize=1024, ttl=24 * 60 * 60)
+
+# Image generations currently in flight, keyed by the client's idempotency key
+# and a hash of their parameters
+inflight: dict[str, asyncio.Task] = {}
+
+def _sniff_mime_type(data: bytes) -> Optional[str]:
+    """Identify PNG, JPEG or WebP data from its magic bytes without decoding it."""
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return "image/png"
+    if data[:3] == b"\xff\xd8\xff":
+        return "image/jpeg"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+def _to_jpeg_bytes(img_data: bytes) -> bytes:
+    """Re-encode image data of any Pillow-readable format as RGB JPEG."""
+    img = Image.open(io.BytesIO(img_data))
+    img_rgb = img if img.mode == "RGB" else img.convert("RGB")
+    img_buffer = io.BytesIO()
+    img_rgb.save(img_buffer, format="JPEG", quality=85)
+    return img_buffer.getvalue()
+
+async def _describe_style(img_data: bytes, idx: int) -> str:
+    """
+    Ask GPT-4 Vision for a prompt-friendly description of a reference image's style.
+    
+    Args:
+        img_data: The reference image data in bytes
+        idx: Position of the image in the request, used for logging
+    """
+    logger.debug("Processing reference image %d", idx + 1)
+    cache_key = hashlib.blake2b(img_data).hexdigest()
+    cached = style_cache.get(cache_key)
+    if cached is not None:
+        logger.debug("Using cached style description for image %d", idx + 1)
+        return cached
+
+    # Convert image to base64. PNG, JPEG and WebP are accepted by the vision
+    # model as-is; anything else is re-encoded as JPEG, which is far smaller than PNG
+    mime_type = _sniff_mime_type(img_data)
+    if mime_type:
+        image_bytes = img_data
+    else:
+        # Decoding and encoding is CPU-bound, so keep it off the event loop
+        image_bytes = await asyncio.to_thread(_to_jpeg_bytes, img_data)
+        mime_type = "image/jpeg"
+    image_b64 = pybase64.b64encode_as_string(image_bytes)
+    image_url = f"data:{mime_type};base64,{image_b64}"
+
+    # Extract style
+    logger.debug("Sending image %d to GPT-4 Vision", idx + 1)
+    vision_response = await call_openai(
+        client.chat.completions.with_raw_response.create,
+        model="gpt-4o",
+        messages=[{
+            "role": "user",
+            "content": [
+                {"type": "text", "text": "Describe the visual style of this image in a prompt-friendly sentence. Be concise."},
+                {"type": "image_url", "image_url": {"url": image_url}}
+            ]
+        }]
+    )
+    style_description = vision_response.choices[0].message.content.strip()
+    logger.debug("Style description for image %d: %s", idx + 1, style_description)
+    style_cache[cache_key] = style_description
+    return style_description
+
+async def _generate_once(params: dict, idempotency_key: str):
+    """
+    Generate an image, sharing one OpenAI call between concurrent retries of the same request.
+    
+    Args:
+        params: Parameters for the images.generate call
+        idempotency_key: Client-supplied key identifying the request being retried
+    """
+    key = hashlib.blake2b(json.dumps([idempotency_key, params], sort_keys=True).encode()).hexdigest()
+    task = inflight.get(key)
+    if task is None:
+        task = asyncio.create_task(call_openai(client.images.with_raw_response.generate, idempotent=False, **params))
+        inflight[key] = task
+        task.add_done_callback(lambda _: inflight.pop(key, None))
+    else:
+        logger.debug("Joining in-flight generation %s", key)
+    # Shield so one caller disconnecting does not cancel the call for the others,
+    # and copy so callers can annotate their response independently
+    response = await asyncio.shield(task)
+    return response.model_copy()
+
+async def close_client():
+    """Close the OpenAI client's connection pool."""
+    await client.close()
 
 async def generate_image(
     prompt: str,
@@ -19,6 +132,7 @@ async def generate_image(
     output_format: str = "png",
     output_compression: int = None,
     reference_images: list[bytes] = None,
+    idempotency_key: str = None,
 ):
     """
     Generate an image using OpenAI's gpt-image-1 model.
@@ -31,52 +145,36 @@ async def generate_image(
         output_format: Output image format
         output_compression: Compression level for output
         reference_images: Optional list of reference image data in bytes
+        idempotency_key: Optional client key for the request. Concurrent retries
+            with the same key and parameters share one generation; without a
+            key every call generates a new image, so repeated prompts yield variations
     """
     try:
         enhanced_prompt = prompt
-        print(f"Original prompt: {prompt}")
-        print(f"Number of reference images: {len(reference_images) if reference_images else 0}")
+        logger.debug("Original prompt: %s", prompt)
+        logger.debug("Number of reference images: %d", len(reference_images) if reference_images else 0)
         
         # Process reference images if provided
         if reference_images:
+            # Describe every reference image concurrently; the vision calls are
+            # independent network round-trips
+            results = await asyncio.gather(
+                *[_describe_style(img_data, idx) for idx, img_data in enumerate(reference_images)],
+                return_exceptions=True,
+            )
             style_descriptions = []
-            for idx, img_data in enumerate(reference_images):
-                print(f"Processing reference image {idx + 1}")
-                try:
-                    # Convert image to base64
-                    img = Image.open(io.BytesIO(img_data))
-                    img_rgb = img.convert("RGB")
-                    img_buffer = io.BytesIO()
-                    img_rgb.save(img_buffer, format="PNG")
-                    img_buffer.seek(0)
-                    image_b64 = base64.b64encode(img_buffer.getvalue()).decode("utf-8")
-                    image_url = f"data:image/png;base64,{image_b64}"
-
-                    # Extract style
-                    print(f"Sending image {idx + 1} to GPT-4 Vision")
-                    vision_response = client.chat.completions.create(
-                        model="gpt-4o",
-                        messages=[{
-                            "role": "user",
-                            "content": [
-                                {"type": "text", "text": "Describe the visual style of this image in a prompt-friendly sentence. Be concise."},
-                                {"type": "image_url", "image_url": {"url": image_url}}
-                            ]
-                        }]
-                    )
-                    style_description = vision_response.choices[0].message.content.strip()
-                    print(f"Style description for image {idx + 1}: {style_description}")
-                    style_descriptions.append(style_description)
-                except Exception as e:
-                    error_msg = f"Failed to process reference image {idx + 1}: {str(e)}"
-                    print(error_msg)
+            for idx, result in enumerate(results):
+                if isinstance(result, Exception):
+                    error_msg = f"Failed to process reference image {idx + 1}: {str(result)}"
+                    logger.error(error_msg)
                     raise Exception(error_msg)
+                style_descriptions.append(result)
 
             # Add style descriptions to the prompt
             if style_descriptions:
                 style_hints = ". Style hints: " + "; ".join(style_descriptions)
                 enhanced_prompt = f"{prompt}{style_hints}"
-                print(f"Enhanced prompt with style hints: {enhanced_prompt}")
+                logger.debug("Enhanced prompt with style hints: %s", enhanced_prompt)
             else:
                 raise Exception("No style descriptions were generated from reference images")
         
@@ -103,9 +201,12 @@ async def generate_image(
             params["output_compression"] = output_compression
 
         # Generate the image
-        print(params)
-        response = client.images.generate(**params)
-        print(response)
+        logger.debug("Generation parameters: %s", params)
+        if idempotency_key:
+            response = await _generate_once(params, idempotency_key)
+        else:
+            response = await call_openai(client.images.with_raw_response.generate, idempotent=False, **params)
+        logger.debug("OpenAI API response: %s", response)
                 
         return response
     except Exception as e:
@@ -133,7 +234,7 @@ async def edit_image(
         output_compression: Compression level for output
     """
     try:
-        print(f"Received edit request with prompt: {prompt}")
+        logger.debug("Received edit request with prompt: %s", prompt)
         # Prepare request parameters
         params = {
             "model": "gpt-image-1",
@@ -143,29 +244,20 @@ async def edit_image(
             "quality": quality,
         }
         
-        # Read all image files and convert to file-like objects
+        # Hand the spooled upload files to the SDK as-is so the multipart
+        # encoder streams them instead of copying each image into memory
         image_files = []
         for idx, upload_file in enumerate(upload_files):
-            content = await upload_file.read()
-            file = io.BytesIO(content)
-            file.name = upload_file.filename or f"image_{idx}.png"
-            image_files.append(file)
-            
-            # Reset file position for future reads if needed
-            await upload_file.seek(0)
+            filename = upload_file.filename or f"image_{idx}.png"
+            image_files.append((filename, upload_file.file, upload_file.content_type))
         
         # Set the image parameter with the file-like objects
         params["image"] = image_files
         
         # Process mask if provided
         if mask_file:
-            mask_content = await mask_file.read()
-            mask_io = io.BytesIO(mask_content)
-            mask_io.name = mask_file.filename or "mask.png"
-            params["mask"] = mask_io
-            
-            # Reset file position for future reads if needed
-            await mask_file.seek(0)
+            mask_filename = mask_file.filename or "mask.png"
+            params["mask"] = (mask_filename, mask_file.file, mask_file.content_type)
             
         if size != "auto":
             params["size"] = size
@@ -174,15 +266,15 @@ async def edit_image(
             params["output_compression"] = output_compression
 
         # Generate the edited image
-        print(f"Editing images with prompt: {prompt}")
-        print(f"Parameters: {params}")
-        response = client.images.edit(**params)
-        print(f"OpenAI API response: {response}")
+        logger.debug("Editing images with prompt: %s", prompt)
+        logger.debug("Parameters: %s", params)
+        response = await call_openai(client.images.with_raw_response.edit, idempotent=False, **params)
+        logger.debug("OpenAI API response: %s", response)
                 
         return response
     except Exception as e:
         error_message = str(e)
-        print(f"Error in edit_image: {error_message}")
+        logger.error("Error in edit_image: %s", error_message)
         
         # Check for quota exceeded error
         if "quota" in error_message.lower():
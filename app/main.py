@@ -1,22 +1,54 @@
+import asyncio
+import logging
 import os
-import base64
 from typing import Optional, List
 
-from fastapi import FastAPI, File, Form, HTTPException, UploadFile, BackgroundTasks
+import pybase64
+from fastapi import Depends, FastAPI, File, Form, Header, HTTPException, UploadFile, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from fastapi.staticfiles import StaticFiles
 
-from app.image_gen import edit_image, generate_image
-from app.shutterstock_api import search_images_by_category
-from app.supabase_storage import upload_image
-from app.supabase_db import get_all_images
+from app.batch_gen import get_batch_status, submit_batch
+from app.image_gen import close_client as close_openai_client, edit_image, generate_image
+from app.shutterstock_api import close_client as close_shutterstock_client, search_images_by_category
+from app.supabase_storage import UploadTooLargeError, shutdown as close_storage_client, upload_image, upload_images_bulk
+from app.supabase_db import get_all_images, get_image_detail
+from app.config import MAX_BATCH_PROMPTS, MAX_REQUEST_BYTES, SERVE_STATIC_FILES
+from app.models import ImageOptions
 
-SUPPORTED_SIZES = {"1024x1024", "1024x1536", "1536x1024", "auto"}
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
 
 # Create directories if they don't exist
 os.makedirs("static/generated", exist_ok=True)
 
-app = FastAPI(title="Ad Creative Generator API")
+# Image responses carry megabytes of base64; orjson serializes them much faster
+app = FastAPI(title="Ad Creative Generator API", default_response_class=ORJSONResponse)
+
+class RequestSizeLimitMiddleware:
+    """Reject oversized uploads from Content-Length before the multipart body is spooled."""
+
+    def __init__(self, app, max_bytes: int):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            for name, value in scope["headers"]:
+                if name == b"content-length":
+                    if value.isdigit() and int(value) > self.max_bytes:
+                        response = ORJSONResponse(
+                            status_code=413,
+                            content={"detail": f"Request body too large. Maximum size is {self.max_bytes} bytes"}
+                        )
+                        await response(scope, receive, send)
+                        return
+                    break
+        await self.app(scope, receive, send)
+
+# Added before CORS so the CORS middleware wraps it and 413s carry CORS headers
+app.add_middleware(RequestSizeLimitMiddleware, max_bytes=MAX_REQUEST_BYTES)
 
 # CORS setup
 app.add_middleware(
@@ -27,8 +59,15 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Serve static files
-app.mount("/static", StaticFiles(directory="static"), name="static")
+# Serve static files (in production nginx serves /static with sendfile)
+if SERVE_STATIC_FILES:
+    app.mount("/static", StaticFiles(directory="static"), name="static")
+
+@app.on_event("shutdown")
+async def shutdown():
+    await close_openai_client()
+    await close_shutterstock_client()
+    await close_storage_client()
 
 @app.get("/")
 async def root():
@@ -60,60 +99,61 @@ async def get_library(limit: int = 50, offset: int = 0, include_reference: bool
         images = await get_all_images(limit, offset, include_reference)
         return {"images": images}
     except Exception as e:
-        print(f"Error in get_library: {str(e)}")
+        logger.error("Error in get_library: %s", e)
         raise HTTPException(status_code=500, detail=f"Error fetching library images: {str(e)}")
     
+@app.get("/library/{image_id}")
+async def get_library_image(image_id: str):
+    """Get the full metadata, including prompt and ad text, for one library image."""
+    image = await get_image_detail(image_id)
+    if image is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return image
+
 @app.post("/generate-image/")
 async def create_image(
     prompt: str = Form(...),
-    size: str = Form("1024x1024"),
-    background: str = Form("auto"),
-    quality: str = Form("auto"),
+    options: ImageOptions = Depends(ImageOptions.as_form),
     output_format: str = Form("png"),
     output_compression: Optional[int] = Form(None),
     reference_images: list[UploadFile] = File(None),
     background_tasks: BackgroundTasks = None,
     category: str = Form(None),
     title: str = Form(None),
+    idempotency_key: Optional[str] = Header(None),
 ):
     """Generate an image using OpenAI's API with customizable parameters."""
-    print(f"Received request with prompt: {prompt}")
-    print(f"Reference images: {reference_images}")
-    
-    if size not in SUPPORTED_SIZES:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Invalid size. Allowed sizes: {', '.join(SUPPORTED_SIZES)}"
-        )
+    logger.debug("Received request with prompt: %s", prompt)
+    logger.debug("Reference images: %s", reference_images)
     
     try:
         # Process reference images if provided
         reference_image_data = []
         if reference_images:
-            print(f"Processing {len(reference_images)} reference images")
-            for idx, image in enumerate(reference_images):
-                print(f"Reading reference image {idx + 1}: {image.filename}")
-                contents = await image.read()
-                print(f"Reference image {idx + 1} size: {len(contents)} bytes")
-                reference_image_data.append(contents)
+            logger.debug("Processing %d reference images", len(reference_images))
+            # Uploads spooled to disk are read in worker threads, so read them concurrently
+            reference_image_data = await asyncio.gather(*[image.read() for image in reference_images])
+            for idx, (image, contents) in enumerate(zip(reference_images, reference_image_data)):
+                logger.debug("Reference image %d (%s) size: %d bytes", idx + 1, image.filename, len(contents))
         
         result = await generate_image(
             prompt=prompt,
-            size=size,
-            background=background,
-            quality=quality,
+            size=options.size,
+            background=options.background,
+            quality=options.quality,
             output_format=output_format,
             output_compression=output_compression,
-            reference_images=reference_image_data if reference_image_data else None
+            reference_images=reference_image_data if reference_image_data else None,
+            idempotency_key=idempotency_key
         )
-        print(f"Generation result: {result}")
+        logger.debug("Generation result: %s", result)
         
         # Store the generated image in Supabase
         if result and result.data and len(result.data) > 0:
             # Get the base64 image data
             b64_image = result.data[0].b64_json
-            # Convert base64 to bytes
-            image_bytes = base64.b64decode(b64_image)
+            # Convert base64 to bytes off the event loop
+            image_bytes = await asyncio.to_thread(pybase64.b64decode, b64_image)
             
             # Upload to Supabase storage
             filename, public_url = await upload_image(
@@ -121,7 +161,7 @@ async def create_image(
                 folder="generated",
                 prompt=prompt,
                 category=category,
-                size=size,
+                size=options.size,
                 title=title
             )
             
@@ -129,47 +169,132 @@ async def create_image(
             result.public_url = public_url
             result.filename = filename
             
-            print(f"Image stored in Supabase: {public_url}")
+            logger.info("Image stored in Supabase: %s", public_url)
         
         return result
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
-        print(f"Error in create_image: {str(e)}")
+        logger.error("Error in create_image: %s", e)
         raise HTTPException(status_code=500, detail=f"Error generating image: {str(e)}")
 
-@app.post("/edit-image/")
-async def edit_image_endpoint(
-    prompt: str = Form(...),
-    images: list[UploadFile] = File(...),
-    mask: Optional[UploadFile] = File(None),
-    size: str = Form("1024x1024"),
-    background: str = Form("auto"),
-    quality: str = Form("auto"),
+@app.post("/generate-image-batch/")
+async def create_image_batch(
+    prompts: list[str] = Form(...),
+    options: ImageOptions = Depends(ImageOptions.as_form),
+    output_format: str = Form("png"),
     output_compression: Optional[int] = Form(None),
-    background_tasks: BackgroundTasks = None,
     category: str = Form(None),
     title: str = Form(None),
 ):
-    """Edit images using OpenAI's API with customizable parameters."""
-    print(f"Received edit request with prompt: {prompt}")
-    print(f"Number of images to edit: {len(images)}")
+    """Generate one image per prompt, running the generations concurrently."""
+    logger.debug("Received batch request with %d prompts", len(prompts))
     
-    if size not in SUPPORTED_SIZES:
+    # Every prompt takes a slot from the shared OpenAI request budget, so a huge
+    # batch would stall interactive requests behind it
+    if len(prompts) > MAX_BATCH_PROMPTS:
         raise HTTPException(
             status_code=400,
-            detail=f"Invalid size. Allowed sizes: {', '.join(SUPPORTED_SIZES)}"
+            detail=f"Too many prompts. Maximum is {MAX_BATCH_PROMPTS} per batch; use /generate-image-batch-async/ for more"
         )
     
-    if background not in {"transparent", "opaque", "auto"}:
-        raise HTTPException(
-            status_code=400,
-            detail="Invalid background. Allowed values: transparent, opaque, auto"
-        )
+    # Concurrency is bounded by the OpenAI limiter, not here
+    results = await asyncio.gather(
+        *[
+            generate_image(
+                prompt=prompt,
+                size=options.size,
+                background=options.background,
+                quality=options.quality,
+                output_format=output_format,
+                output_compression=output_compression,
+            )
+            for prompt in prompts
+        ],
+        return_exceptions=True,
+    )
     
-    if quality not in {"standard", "low", "medium", "high", "auto"}:
-        raise HTTPException(
-            status_code=400,
-            detail="Invalid quality. Allowed values: standard, low, medium, high, auto"
+    # Store every generated image in Supabase concurrently
+    generated = [
+        (prompt, result) for prompt, result in zip(prompts, results)
+        if not isinstance(result, Exception) and result.data
+    ]
+    all_image_bytes = await asyncio.gather(
+        *[asyncio.to_thread(pybase64.b64decode, result.data[0].b64_json) for _, result in generated]
+    )
+    uploads = await upload_images_bulk(
+        [
+            {
+                "image_bytes": image_bytes,
+                "folder": "generated",
+                "prompt": prompt,
+                "category": category,
+                "size": options.size,
+                "title": title,
+            }
+            for (prompt, _), image_bytes in zip(generated, all_image_bytes)
+        ],
+        return_exceptions=True,
+    )
+    for (prompt, result), upload in zip(generated, uploads):
+        if isinstance(upload, Exception):
+            logger.error("Error storing batch image for prompt '%s': %s", prompt, upload)
+            result.upload_error = str(upload)
+            continue
+        result.filename, result.public_url = upload
+    
+    response = []
+    for prompt, result in zip(prompts, results):
+        if isinstance(result, Exception):
+            logger.error("Error in create_image_batch for prompt '%s': %s", prompt, result)
+            response.append({"prompt": prompt, "error": str(result)})
+        else:
+            response.append(result)
+    return {"results": response}
+
+@app.post("/generate-image-batch-async/")
+async def create_image_batch_async(
+    prompts: list[str] = Form(...),
+    options: ImageOptions = Depends(ImageOptions.as_form),
+    output_format: str = Form("png"),
+):
+    """Queue prompts on the OpenAI Batch API for non-interactive generation."""
+    try:
+        batch_id = await submit_batch(
+            prompts=prompts,
+            size=options.size,
+            background=options.background,
+            quality=options.quality,
+            output_format=output_format,
         )
+        return {"batch_id": batch_id}
+    except Exception as e:
+        logger.error("Error in create_image_batch_async: %s", e)
+        raise HTTPException(status_code=500, detail=f"Error submitting batch: {str(e)}")
+
+@app.get("/batch-status/{batch_id}")
+async def batch_status(batch_id: str):
+    """Get the status of a batch job and its results once completed."""
+    try:
+        return await get_batch_status(batch_id)
+    except Exception as e:
+        logger.error("Error in batch_status: %s", e)
+        raise HTTPException(status_code=500, detail=f"Error fetching batch status: {str(e)}")
+
+@app.post("/edit-image/")
+async def edit_image_endpoint(
+    prompt: str = Form(...),
+    images: list[UploadFile] = File(...),
+    mask: Optional[UploadFile] = File(None),
+    options: ImageOptions = Depends(ImageOptions.as_form),
+    output_compression: Optional[int] = Form(None),
+    background_tasks: BackgroundTasks = None,
+    category: str = Form(None),
+    title: str = Form(None),
+):
+    """Edit images using OpenAI's API with customizable parameters."""
+    logger.debug("Received edit request with prompt: %s", prompt)
+    logger.debug("Number of images to edit: %d", len(images))
     
     try:
         # Instead of reading all contents at once, pass the UploadFile objects directly
@@ -182,19 +307,19 @@ async def edit_image_endpoint(
             upload_files=images,  # Pass the UploadFile objects directly
             prompt=prompt,
             mask_file=mask_file,  # Pass the UploadFile object directly
-            size=size,
-            background=background,
-            quality=quality,
+            size=options.size,
+            background=options.background,
+            quality=options.quality,
             output_compression=output_compression,
         )
-        print(f"Edit result: {result}")
+        logger.debug("Edit result: %s", result)
         
         # Store the edited image in Supabase
         if result and result.data and len(result.data) > 0:
             # Get the base64 image data
             b64_image = result.data[0].b64_json
-            # Convert base64 to bytes
-            image_bytes = base64.b64decode(b64_image)
+            # Convert base64 to bytes off the event loop
+            image_bytes = await asyncio.to_thread(pybase64.b64decode, b64_image)
             
             # Upload to Supabase storage
             filename, public_url = await upload_image(
@@ -202,7 +327,7 @@ async def edit_image_endpoint(
                 folder="edited",
                 prompt=prompt,
                 category=category,
-                size=size,
+                size=options.size,
                 title=title
             )
             
@@ -210,9 +335,11 @@ async def edit_image_endpoint(
             result.public_url = public_url
             result.filename = filename
             
-            print(f"Edited image stored in Supabase: {public_url}")
+            logger.info("Edited image stored in Supabase: %s", public_url)
         
         return result
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
-        print(f"Error in edit_image_endpoint: {str(e)}")
+        logger.error("Error in edit_image_endpoint: %s", e)
         raise HTTPException(status_code=500, detail=f"Error editing image: {str(e)}")
\ No newline at end of file
@@ -0,0 +1,46 @@
+from fastapi import Form, HTTPException
+from pydantic import BaseModel, ValidationError, field_validator
+
+SUPPORTED_SIZES = {"1024x1024", "1024x1536", "1536x1024", "auto"}
+SUPPORTED_BACKGROUNDS = {"transparent", "opaque", "auto"}
+SUPPORTED_QUALITIES = {"standard", "low", "medium", "high", "auto"}
+
+class ImageOptions(BaseModel):
+    """Output options shared by the image generation and editing endpoints."""
+    size: str = "1024x1024"
+    background: str = "auto"
+    quality: str = "auto"
+
+    @field_validator("size")
+    @classmethod
+    def check_size(cls, value: str) -> str:
+        if value not in SUPPORTED_SIZES:
+            raise ValueError(f"Invalid size. Allowed sizes: {', '.join(SUPPORTED_SIZES)}")
+        return value
+
+    @field_validator("background")
+    @classmethod
+    def check_background(cls, value: str) -> str:
+        if value not in SUPPORTED_BACKGROUNDS:
+            raise ValueError("Invalid background. Allowed values: transparent, opaque, auto")
+        return value
+
+    @field_validator("quality")
+    @classmethod
+    def check_quality(cls, value: str) -> str:
+        if value not in SUPPORTED_QUALITIES:
+            raise ValueError("Invalid quality. Allowed values: standard, low, medium, high, auto")
+        return value
+
+    @classmethod
+    def as_form(
+        cls,
+        size: str = Form("1024x1024"),
+        background: str = Form("auto"),
+        quality: str = Form("auto"),
+    ) -> "ImageOptions":
+        """FastAPI dependency building the options from multipart form fields."""
+        try:
+            return cls(size=size, background=background, quality=quality)
+        except ValidationError as e:
+            raise HTTPException(status_code=400, detail=str(e.errors()[0]["ctx"]["error"]))
@@ -0,0 +1,96 @@
+import asyncio
+import logging
+import os
+import random
+import time
+
+import openai
+
+# Maximum number of OpenAI requests allowed in flight at once
+MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", 8))
+# Client-side request budget, refilled continuously over each minute
+MAX_REQUESTS_PER_MINUTE = float(os.getenv("OPENAI_MAX_REQUESTS_PER_MINUTE", 60))
+# Attempts per call before a rate limit or transient error is surfaced to the caller
+MAX_ATTEMPTS = 3
+
+logger = logging.getLogger(__name__)
+
+SEM = asyncio.Semaphore(MAX_CONCURRENCY)
+
+
+class RequestBucket:
+    """Token bucket that paces requests to stay under the account's rate limit."""
+
+    def __init__(self, requests_per_minute: float):
+        self.capacity = requests_per_minute
+        self.available = requests_per_minute
+        self.last_update = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self.last_update
+        self.available = min(self.capacity, self.available + elapsed * self.capacity / 60)
+        self.last_update = now
+
+    async def acquire(self):
+        """Wait until a request slot is available and take it."""
+        async with self._lock:
+            self._refill()
+            while self.available < 1:
+                await asyncio.sleep((1 - self.available) * 60 / self.capacity)
+                self._refill()
+            self.available -= 1
+
+    def update_from_headers(self, headers):
+        """Never assume more budget than the API reports as remaining."""
+        remaining = headers.get("x-ratelimit-remaining-requests")
+        if remaining is None:
+            return
+        try:
+            remaining = float(remaining)
+        except ValueError:
+            return
+        self._refill()
+        self.available = min(self.available, remaining)
+
+
+bucket = RequestBucket(MAX_REQUESTS_PER_MINUTE)
+
+async def call_openai(method, idempotent=True, **kwargs):
+    """
+    Call an OpenAI API method under the client-side concurrency and rate limits.
+
+    This is the only retry policy for these calls: rate limits, connection
+    errors and 5xx responses are retried here, and the client itself is
+    built with ``max_retries=0``.
+
+    Args:
+        method: A ``with_raw_response`` method of the async client,
+            e.g. ``client.images.with_raw_response.generate``
+        idempotent: Whether the call is safe to repeat after a timeout. A
+            timed-out image generation may still complete and be billed, so
+            those calls pass False and timeouts are surfaced instead
+        **kwargs: Parameters forwarded to the method
+
+    Returns:
+        The parsed API response
+    """
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        await bucket.acquire()
+        try:
+            async with SEM:
+                raw_response = await method(**kwargs)
+        except (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError) as e:
+            # An exhausted quota will not recover by waiting
+            if getattr(e, "code", None) == "insufficient_quota" or attempt == MAX_ATTEMPTS:
+                raise
+            if isinstance(e, openai.APITimeoutError) and not idempotent:
+                raise
+            delay = 2 ** attempt + random.uniform(0, 1)
+            logger.warning("OpenAI %s, retrying in %.1fs (attempt %d/%d)", type(e).__name__, delay, attempt, MAX_ATTEMPTS)
+            await asyncio.sleep(delay)
+            continue
+
+        bucket.update_from_headers(raw_response.headers)
+        return raw_response.parse()
@@ -1,9 +1,34 @@
 import httpx
+from cachetools import TTLCache
 from app.config import SHUTTERSTOCK_API_KEY
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 
 BASE_URL = "https://api.shutterstock.com/v2"
 
+# Featured collections change rarely; cache successful responses by page size
+_collections_cache = TTLCache(maxsize=64, ttl=300)
+
+# Shared client so requests reuse pooled keep-alive connections to the API
+_http: Optional[httpx.AsyncClient] = None
+
+async def _get_client() -> httpx.AsyncClient:
+    """Return the shared HTTP client, creating it on first use."""
+    global _http
+    if _http is None:
+        _http = httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+            timeout=httpx.Timeout(30.0, connect=5.0),
+        )
+    return _http
+
+async def close_client():
+    """Close the shared HTTP client."""
+    global _http
+    if _http is not None:
+        await _http.aclose()
+        _http = None
+
 async def search_images_by_category(category: str, per_page: int = 20):
     """Search for images in a specific category."""
     headers = {
@@ -16,24 +41,24 @@ async def search_images_by_category(category: str, per_page: int = 20):
         "view": "full"
     }
     
-    async with httpx.AsyncClient() as client:
-        response = await client.get(f"{BASE_URL}/images/search", headers=headers, params=params)
-        data = response.json()
-        
-        # Extract relevant image information
-        processed_images = []
-        if "data" in data:
-            for image in data["data"]:
-                image_info = {
-                    "id": image["id"],
-                    "description": image.get("description", ""),
-                    "preview_url": image.get("assets", {}).get("preview", {}).get("url", ""),
-                    "thumbnail_url": image.get("assets", {}).get("large_thumb", {}).get("url", ""),
-                    "categories": [cat.get("name") for cat in image.get("categories", [])]
-                }
-                processed_images.append(image_info)
-        
-        return processed_images
+    client = await _get_client()
+    response = await client.get(f"{BASE_URL}/images/search", headers=headers, params=params)
+    data = response.json()
+    
+    # Extract relevant image information
+    processed_images = []
+    if "data" in data:
+        for image in data["data"]:
+            image_info = {
+                "id": image["id"],
+                "description": image.get("description", ""),
+                "preview_url": image.get("assets", {}).get("preview", {}).get("url", ""),
+                "thumbnail_url": image.get("assets", {}).get("large_thumb", {}).get("url", ""),
+                "categories": [cat.get("name") for cat in image.get("categories", [])]
+            }
+            processed_images.append(image_info)
+    
+    return processed_images
 
 async def get_similar_images(image_url: str):
     """Find similar images using computer vision API."""
@@ -81,30 +106,36 @@ async def get_collections(per_page: int = 20):
             "Authorization": f"Bearer {SHUTTERSTOCK_API_KEY}"
         }
     
+    cached = _collections_cache.get(per_page)
+    if cached is not None:
+        return cached
+    
     params = {
         "per_page": per_page
     }
     
     try:
         # Try the featured collections endpoint first
-        async with httpx.AsyncClient() as client:
-            try:
-                response = await client.get(f"{BASE_URL}/images/collections/featured", headers=headers, params=params)
+        client = await _get_client()
+        try:
+            response = await client.get(f"{BASE_URL}/images/collections/featured", headers=headers, params=params)
+            response.raise_for_status()
+            data = response.json()
+            print(f"Shutterstock collections API response: {data}")
+            _collections_cache[per_page] = data
+            return data
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code == 404:
+                # If featured endpoint fails, try the standard collections endpoint
+                print("Featured collections endpoint not found, trying standard collections endpoint")
+                response = await client.get(f"{BASE_URL}/images/collections", headers=headers, params=params)
                 response.raise_for_status()
                 data = response.json()
-                print(f"Shutterstock collections API response: {data}")
+                print(f"Shutterstock standard collections API response: {data}")
+                _collections_cache[per_page] = data
                 return data
-            except httpx.HTTPStatusError as e:
-                if e.response.status_code == 404:
-                    # If featured endpoint fails, try the standard collections endpoint
-                    print("Featured collections endpoint not found, trying standard collections endpoint")
-                    response = await client.get(f"{BASE_URL}/images/collections", headers=headers, params=params)
-                    response.raise_for_status()
-                    data = response.json()
-                    print(f"Shutterstock standard collections API response: {data}")
-                    return data
-                else:
-                    raise e
+            else:
+                raise e
     except httpx.HTTPStatusError as e:
         print(f"HTTP error occurred: {e.response.status_code} - {e.response.text}")
         # Return mock data on error
@@ -141,21 +172,21 @@ async def get_collection_items(collection_id: str, per_page: int = 20):
         "per_page": per_page
     }
     
-    async with httpx.AsyncClient() as client:
-        response = await client.get(f"{BASE_URL}/images/collections/featured/{collection_id}/items", headers=headers, params=params)
-        data = response.json()
-        
-        # Extract relevant image information
-        processed_images = []
-        if "data" in data:
-            for image in data["data"]:
-                image_info = {
-                    "id": image["id"],
-                    "description": image.get("description", ""),
-                    "preview_url": image.get("assets", {}).get("preview", {}).get("url", ""),
-                    "thumbnail_url": image.get("assets", {}).get("large_thumb", {}).get("url", ""),
-                    "categories": [cat.get("name") for cat in image.get("categories", [])]
-                }
-                processed_images.append(image_info)
-        
-        return processed_images
\ No newline at end of file
+    client = await _get_client()
+    response = await client.get(f"{BASE_URL}/images/collections/featured/{collection_id}/items", headers=headers, params=params)
+    data = response.json()
+    
+    # Extract relevant image information
+    processed_images = []
+    if "data" in data:
+        for image in data["data"]:
+            image_info = {
+                "id": image["id"],
+                "description": image.get("description", ""),
+                "preview_url": image.get("assets", {}).get("preview", {}).get("url", ""),
+                "thumbnail_url": image.get("assets", {}).get("large_thumb", {}).get("url", ""),
+                "categories": [cat.get("name") for cat in image.get("categories", [])]
+            }
+            processed_images.append(image_info)
+    
+    return processed_images
\ No newline at end of file
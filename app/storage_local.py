@@ -0,0 +1,17 @@
+import asyncio
+
+def _write(path, data):
+    # No fsync or page-cache eviction: the response hands the client a
+    # /static URL for this file, which is read back right away
+    with open(path, "wb") as f:
+        f.write(data)
+
+async def write_bytes(path, data):
+    """
+    Write bytes to a local file without blocking the event loop.
+    
+    Args:
+        path (str): Destination file path
+        data (bytes): The data to write
+    """
+    await asyncio.to_thread(_write, path, data)
@@ -1,3 +1,7 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from cachetools import TTLCache
+from postgrest.exceptions import APIError
 from supabase import create_client, Client
 from app.config import SUPABASE_URL, SUPABASE_KEY
 from typing import Optional, List, Dict, Any
@@ -9,6 +13,66 @@ supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 # Table name for image metadata
 IMAGE_TABLE = "image_metadata"
 
+# Table recording which worker collects each completed batch, and its results
+BATCH_TABLE = "batch_results"
+
+# A claim older than this is assumed abandoned by a worker that died mid-collection
+BATCH_CLAIM_TIMEOUT = timedelta(minutes=10)
+
+# Columns returned by list views; the long prompt and ad_text fields are only
+# fetched for a single image through get_image_detail
+LIST_COLUMNS = "image_id,public_url,title,category,size,is_reference,created_at"
+
+# Recent list query results; cleared whenever this process writes metadata
+_query_cache = TTLCache(maxsize=256, ttl=60)
+
+# Metadata inserts are coalesced for this long and written in one request
+INSERT_BATCH_DELAY = 0.05
+
+# Rows waiting to be inserted, each paired with the future its caller awaits
+_pending_inserts = []
+_flush_handle = None
+_flush_task = None
+
+async def _execute(request):
+    """Run a PostgREST request in a worker thread; the supabase client is synchronous."""
+    return await asyncio.to_thread(request.execute)
+
+def _schedule_flush():
+    global _flush_task
+    _flush_task = asyncio.ensure_future(_flush_inserts())
+
+async def _flush_inserts():
+    """Insert all pending metadata rows in a single request and resolve their callers."""
+    global _flush_handle
+    _flush_handle = None
+    batch = list(_pending_inserts)
+    _pending_inserts.clear()
+    
+    try:
+        response = await _execute(supabase.table(IMAGE_TABLE).insert([row for row, _ in batch]))
+        # PostgREST returns inserted rows in request order
+        rows = response.data or []
+    except Exception as e:
+        print(f"Error inserting image metadata batch, retrying rows individually: {str(e)}")
+        # The batch is one statement, so a single bad row fails all of them;
+        # insert each row on its own so only the bad one is lost
+        rows = await asyncio.gather(*[_insert_one(row) for row, _ in batch])
+    _query_cache.clear()
+    
+    for idx, (_, future) in enumerate(batch):
+        if not future.done():
+            future.set_result(rows[idx] if idx < len(rows) else None)
+
+async def _insert_one(row):
+    """Insert a single metadata row, returning the stored record or None on failure."""
+    try:
+        response = await _execute(supabase.table(IMAGE_TABLE).insert(row))
+        return response.data[0] if response.data else None
+    except Exception as e:
+        print(f"Error inserting image metadata for {row['image_id']}: {str(e)}")
+        return None
+
 async def insert_image_metadata(
     image_id: str,
     storage_path: str,
@@ -50,11 +114,15 @@ async def insert_image_metadata(
             "title": title
         }
         
-        response = supabase.table(IMAGE_TABLE).insert(data).execute()
+        # Queue the row; concurrent inserts are written together in one round-trip
+        global _flush_handle
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        _pending_inserts.append((data, future))
+        if _flush_handle is None:
+            _flush_handle = loop.call_later(INSERT_BATCH_DELAY, _schedule_flush)
         
-        if response.data:
-            return response.data[0]
-        return None
+        return await future
     except Exception as e:
         print(f"Error inserting image metadata: {str(e)}")
         return None
@@ -70,14 +138,20 @@ async def get_images_by_category(category: str, limit: int = 20) -> List[Dict[st
     Returns:
         List of image metadata records
     """
+    cache_key = ("category", category, limit)
+    cached = _query_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    
     try:
-        response = supabase.table(IMAGE_TABLE)\
-            .select("*")\
+        request = supabase.table(IMAGE_TABLE)\
+            .select(LIST_COLUMNS)\
             .eq("category", category)\
             .order("created_at", desc=True)\
-            .limit(limit)\
-            .execute()
+            .limit(limit)
+        response = await _execute(request)
             
+        _query_cache[cache_key] = response.data
         return response.data
     except Exception as e:
         print(f"Error retrieving images by category: {str(e)}")
@@ -95,17 +169,23 @@ async def get_all_images(limit: int = 50, offset: int = 0, include_reference: bo
     Returns:
         List of image metadata records
     """
+    cache_key = ("all", limit, offset, include_reference)
+    cached = _query_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    
     try:
         query = supabase.table(IMAGE_TABLE)\
-            .select("*")\
+            .select(LIST_COLUMNS)\
             .order("created_at", desc=True)
             
         # Filter out reference images if not included
         if not include_reference:
             query = query.eq("is_reference", False)
             
-        response = query.range(offset, offset + limit - 1).execute()
+        response = await _execute(query.range(offset, offset + limit - 1))
             
+        _query_cache[cache_key] = response.data
         return response.data
     except Exception as e:
         print(f"Error retrieving all images: {str(e)}")
@@ -123,18 +203,41 @@ async def search_images(query: str, limit: int = 20) -> List[Dict[str, Any]]:
         List of matching image metadata records
     """
     try:
-        # Using ilike for basic text matching
-        response = supabase.table(IMAGE_TABLE)\
-            .select("*")\
+        # Using ilike for basic text matching; backed by pg_trgm GIN indexes
+        # (see supabase/migrations) so the leading wildcard does not seq-scan
+        request = supabase.table(IMAGE_TABLE)\
+            .select(LIST_COLUMNS)\
             .or_(f"prompt.ilike.%{query}%,ad_text.ilike.%{query}%")\
-            .limit(limit)\
-            .execute()
+            .limit(limit)
+        response = await _execute(request)
             
         return response.data
     except Exception as e:
         print(f"Error searching images: {str(e)}")
         return []
 
+async def get_image_detail(image_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Retrieve the full metadata record for a single image.
+    
+    Args:
+        image_id: The image ID to look up
+        
+    Returns:
+        The image metadata record, or None if not found
+    """
+    try:
+        request = supabase.table(IMAGE_TABLE)\
+            .select("*")\
+            .eq("image_id", image_id)\
+            .limit(1)
+        response = await _execute(request)
+            
+        return response.data[0] if response.data else None
+    except Exception as e:
+        print(f"Error retrieving image detail: {str(e)}")
+        return None
+
 async def delete_image_metadata(image_id: str) -> bool:
     """
     Delete image metadata for a specific image.
@@ -146,12 +249,108 @@ async def delete_image_metadata(image_id: str) -> bool:
         True if successful, False otherwise
     """
     try:
-        response = supabase.table(IMAGE_TABLE)\
+        request = supabase.table(IMAGE_TABLE)\
             .delete()\
-            .eq("image_id", image_id)\
-            .execute()
+            .eq("image_id", image_id)
+        response = await _execute(request)
+        _query_cache.clear()
             
         return len(response.data) > 0
     except Exception as e:
         print(f"Error deleting image metadata: {str(e)}")
         return False
+
+async def get_batch_results(batch_id: str) -> Optional[List[Dict[str, Any]]]:
+    """
+    Retrieve the stored results of a collected batch.
+    
+    Args:
+        batch_id: The OpenAI batch ID
+        
+    Returns:
+        The stored results, or None if the batch has not been collected yet
+    """
+    try:
+        request = supabase.table(BATCH_TABLE)\
+            .select("results")\
+            .eq("batch_id", batch_id)\
+            .limit(1)
+        response = await _execute(request)
+            
+        return response.data[0]["results"] if response.data else None
+    except Exception as e:
+        print(f"Error retrieving batch results: {str(e)}")
+        return None
+
+async def claim_batch(batch_id: str) -> bool:
+    """
+    Claim a completed batch for collection, so only one worker uploads its images.
+    
+    Args:
+        batch_id: The OpenAI batch ID
+        
+    Returns:
+        True if this worker should collect the batch, False if another one is
+    """
+    try:
+        await _execute(supabase.table(BATCH_TABLE).insert({"batch_id": batch_id}))
+        return True
+    except APIError as e:
+        if e.code != "23505":
+            print(f"Error claiming batch: {str(e)}")
+            return True
+    except Exception as e:
+        # Without the table, fall back to collecting in this worker
+        print(f"Error claiming batch: {str(e)}")
+        return True
+    
+    # Already claimed; take over only a claim that was abandoned without results
+    try:
+        now = datetime.now(timezone.utc)
+        request = supabase.table(BATCH_TABLE)\
+            .update({"claimed_at": now.isoformat()})\
+            .eq("batch_id", batch_id)\
+            .is_("results", "null")\
+            .lt("claimed_at", (now - BATCH_CLAIM_TIMEOUT).isoformat())
+        response = await _execute(request)
+            
+        return len(response.data) > 0
+    except Exception as e:
+        print(f"Error reclaiming batch: {str(e)}")
+        return False
+
+async def release_batch_claim(batch_id: str) -> None:
+    """
+    Drop this worker's claim on a batch whose collection failed, so the next poll retries it.
+    
+    Args:
+        batch_id: The OpenAI batch ID
+    """
+    try:
+        request = supabase.table(BATCH_TABLE)\
+            .delete()\
+            .eq("batch_id", batch_id)\
+            .is_("results", "null")
+        await _execute(request)
+    except Exception as e:
+        print(f"Error releasing batch claim: {str(e)}")
+
+async def save_batch_results(batch_id: str, results: List[Dict[str, Any]]) -> bool:
+    """
+    Store the results of a collected batch for every worker to serve.
+    
+    Args:
+        batch_id: The OpenAI batch ID
+        results: The per-prompt results
+        
+    Returns:
+        True if successful, False otherwise
+    """
+    try:
+        request = supabase.table(BATCH_TABLE)\
+            .upsert({"batch_id": batch_id, "results": results})
+        await _execute(request)
+        return True
+    except Exception as e:
+        print(f"Error saving batch results: {str(e)}")
+        return False
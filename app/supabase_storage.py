@@ -1,55 +1,222 @@
-import os
+import asyncio
 import io
+import os
+import random
 import uuid
 import base64
+import logging
+import httpx
+from cachetools import TTLCache
+from urllib.parse import quote
+from PIL import Image
 from supabase import create_client, Client
-from app.config import SUPABASE_URL, SUPABASE_KEY, SUPABASE_BUCKET_NAME
-import traceback
+from app.config import SUPABASE_URL, SUPABASE_KEY, SUPABASE_BUCKET_NAME, SUPABASE_UPLOAD_CONCURRENCY, SUPABASE_RESUMABLE_THRESHOLD, MAX_UPLOAD_BYTES, STORE_AS_WEBP
+from app.storage_local import write_bytes
+
+# Metadata is stored alongside uploads when the database module is available
+try:
+    from app.supabase_db import insert_image_metadata, delete_image_metadata
+except ImportError:
+    insert_image_metadata = delete_image_metadata = None
+
+logger = logging.getLogger(__name__)
 
 # Initialize Supabase client
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 
-# Check if a folder exists and create it if it doesn't
-async def ensure_folder_exists(folder):
+def _raise_transient_status(response):
+    """
+    Raise on 429 and 5xx responses before the storage client sees them: it parses
+    error bodies as JSON, which fails on a gateway's HTML 502 page and loses the status.
+    """
+    if response.status_code == 429 or response.status_code >= 500:
+        response.raise_for_status()
+
+# Swap the storage client's default session for one with a tuned keep-alive
+# pool, HTTP/2 and connection retries, keeping its base URL and auth headers
+_default_session = supabase.storage.session
+_storage_session = type(_default_session)(
+    base_url=_default_session.base_url,
+    headers=_default_session.headers,
+    timeout=httpx.Timeout(30.0, connect=5.0),
+    event_hooks={"response": [_raise_transient_status]},
+    transport=httpx.HTTPTransport(
+        http2=True,
+        retries=2,
+        limits=httpx.Limits(max_connections=20, max_keepalive_connections=20, keepalive_expiry=30.0),
+    ),
+)
+_default_session.close()
+supabase.storage.session = supabase.storage._client = _storage_session
+
+# Caps concurrent storage mutations so bursts don't trigger 429s or GOAWAYs
+_upload_sem = asyncio.Semaphore(SUPABASE_UPLOAD_CONCURRENCY)
+
+# Background metadata inserts, referenced here so they aren't garbage collected
+_bg_tasks: set[asyncio.Task] = set()
+
+def _on_metadata_stored(task):
+    """Log the outcome of a background metadata insert."""
+    _bg_tasks.discard(task)
+    if task.cancelled():
+        return
+    error = task.exception()
+    if error is not None:
+        logger.error("Error storing metadata: %s", error)
+    elif task.result() is None:
+        logger.warning("Metadata for %s was not stored", task.get_name())
+
+# Recent list_images results, so polling dashboards don't LIST the bucket every
+# time; cleared whenever this process uploads or deletes an object
+_list_cache = TTLCache(maxsize=64, ttl=5)
+
+async def _discard_metadata(metadata_task, image_id):
+    """Delete the metadata row of a failed upload once its insert has finished."""
+    await asyncio.wait([metadata_task])
+    await delete_image_metadata(image_id)
+
+def _status_code(error):
+    """HTTP status of a failed storage call, from httpx or from the storage client's StorageException."""
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code
+    if error.args and isinstance(error.args[0], dict):
+        try:
+            return int(error.args[0].get("statusCode"))
+        except (TypeError, ValueError):
+            return None
+    return None
+
+def _is_transient(error):
+    """Connection failures (including HTTP/2 GOAWAY and timeouts), 429s and 5xx responses are worth retrying."""
+    if isinstance(error, httpx.TransportError):
+        return True
+    status = _status_code(error)
+    return status is not None and (status == 429 or status >= 500)
+
+async def _with_retry(fn, *args, attempts=3, base=0.25, cap=4.0, retry_kwargs=None, **kwargs):
     """
-    Check if a folder exists in the bucket and create it if it doesn't.
+    Run a synchronous storage call in a worker thread, retrying transient failures
+    with jittered exponential backoff.
     
     Args:
-        folder (str): The folder name to check/create
+        fn: The storage client method to call
+        attempts (int): Maximum number of attempts
+        base (float): Delay before the first retry, in seconds
+        cap (float): Upper bound for the delay between retries, in seconds
+        retry_kwargs (dict, optional): Keyword arguments that replace kwargs on retries
         
     Returns:
-        bool: True if the folder exists or was created successfully
+        The result of the call
     """
-    try:
-        # Try to list the contents of the folder to see if it exists
+    for attempt in range(attempts):
+        call_kwargs = kwargs if attempt == 0 or retry_kwargs is None else retry_kwargs
         try:
-            supabase.storage.from_(SUPABASE_BUCKET_NAME).list(folder)
-            print(f"Folder '{folder}' exists in bucket '{SUPABASE_BUCKET_NAME}'")
-            return True
+            return await asyncio.to_thread(fn, *args, **call_kwargs)
         except Exception as e:
-            # If we get an error, the folder might not exist
-            print(f"Folder '{folder}' might not exist: {str(e)}")
-            
-            # Create an empty file in the folder to create it
-            # This is a common way to create "folders" in object storage
-            empty_file = io.BytesIO(b"")
-            placeholder_path = f"{folder}/.placeholder"
-            
-            try:
-                supabase.storage.from_(SUPABASE_BUCKET_NAME).upload(
-                    placeholder_path,
-                    empty_file,
-                    file_options={"content-type": "text/plain"}
-                )
-                print(f"Created folder '{folder}' in bucket '{SUPABASE_BUCKET_NAME}'")
-                return True
-            except Exception as create_error:
-                print(f"Failed to create folder '{folder}': {str(create_error)}")
-                return False
-    except Exception as e:
-        print(f"Error checking/creating folder: {str(e)}")
-        traceback.print_exc()
-        return False
+            if not _is_transient(e) or attempt == attempts - 1:
+                raise
+            delay = min(cap, base * 2 ** attempt) + random.uniform(0, 0.1)
+            logger.warning("Transient storage error, retrying in %.2fs: %s", delay, e)
+            await asyncio.sleep(delay)
+
+def _public_url(path: str) -> str:
+    """Build the public URL of an object; the template is fixed, so no client call is needed."""
+    return f"{SUPABASE_URL}/storage/v1/object/public/{SUPABASE_BUCKET_NAME}/{quote(path, safe='/')}"
+
+def _image_type(image_bytes):
+    """Content type and file extension of PNG, JPEG or WebP data, from its magic bytes."""
+    if image_bytes[:3] == b"\xff\xd8\xff":
+        return "image/jpeg", ".jpg"
+    if image_bytes[:4] == b"RIFF" and image_bytes[8:12] == b"WEBP":
+        return "image/webp", ".webp"
+    # PNG, and the default for anything unrecognised
+    return "image/png", ".png"
+
+def _to_webp_bytes(image_bytes):
+    """Re-encode PNG image data as WebP, keeping transparency."""
+    img = Image.open(io.BytesIO(image_bytes))
+    img_buffer = io.BytesIO()
+    img.save(img_buffer, format="WEBP", quality=85, method=4)
+    return img_buffer.getvalue()
+
+class UploadTooLargeError(ValueError):
+    """Raised when an image exceeds MAX_UPLOAD_BYTES; retrying will not help."""
+
+# Supabase requires every resumable upload chunk except the last to be exactly 6 MB
+RESUMABLE_CHUNK_SIZE = 6 * 1024 * 1024
+
+def _create_resumable_upload(storage_path, size, content_type):
+    """Create a TUS upload for the object and return its upload URL."""
+    metadata = {
+        "bucketName": SUPABASE_BUCKET_NAME,
+        "objectName": storage_path,
+        "contentType": content_type,
+    }
+    response = _storage_session.post(
+        "upload/resumable",
+        headers={
+            "Tus-Resumable": "1.0.0",
+            "Upload-Length": str(size),
+            "Upload-Metadata": ",".join(
+                f"{key} {base64.b64encode(value.encode()).decode()}" for key, value in metadata.items()
+            ),
+        },
+    )
+    response.raise_for_status()
+    return response.headers["location"]
+
+def _send_chunk(upload_url, view, offset, resync=False):
+    """
+    PATCH the chunk of a TUS upload that starts at offset and return the server's new offset.
+    
+    With resync, the server is first asked (HEAD) how much it already has, as TUS
+    requires after a failed PATCH: the lost request may have been stored anyway.
+    """
+    if resync:
+        response = _storage_session.head(upload_url, headers={"Tus-Resumable": "1.0.0"})
+        response.raise_for_status()
+        offset = int(response.headers["upload-offset"])
+        if offset >= len(view):
+            return offset
+    chunk = view[offset:offset + RESUMABLE_CHUNK_SIZE]
+    response = _storage_session.patch(
+        upload_url,
+        # Wrapping the memoryview in an iterator lets httpx send it without copying
+        content=iter([chunk]),
+        headers={
+            "Tus-Resumable": "1.0.0",
+            "Upload-Offset": str(offset),
+            "Content-Type": "application/offset+octet-stream",
+            "Content-Length": str(len(chunk)),
+        },
+    )
+    response.raise_for_status()
+    return int(response.headers["upload-offset"])
+
+async def _upload_resumable(storage_path, image_bytes, content_type):
+    """
+    Upload a large object through Supabase's resumable (TUS) endpoint.
+    
+    Chunks are sent one after another, as the protocol requires, so only the
+    current chunk is in flight. A failed chunk is retried on its own, resuming
+    from the offset the server reports.
+    
+    Args:
+        storage_path (str): The path within the bucket
+        image_bytes (bytes): The data to upload
+        content_type (str): The MIME type of the object
+    """
+    upload_url = await _with_retry(_create_resumable_upload, storage_path, len(image_bytes), content_type)
+    view = memoryview(image_bytes)
+    offset = 0
+    while offset < len(view):
+        offset = await _with_retry(_send_chunk, upload_url, view, offset, retry_kwargs={"resync": True})
+
+async def shutdown():
+    """Wait for pending metadata inserts, then close the storage client's connection pool."""
+    if _bg_tasks:
+        await asyncio.gather(*_bg_tasks, return_exceptions=True)
+    _storage_session.close()
 
 # Upload an image from bytes
 async def upload_image(image_bytes, folder="generated", filename=None, prompt=None, ad_text=None, category=None, size="1024x1024", is_reference=False, title=None):
@@ -69,93 +236,145 @@ async def upload_image(image_bytes, folder="generated", filename=None, prompt=No
         
     Returns:
         tuple: (filename, public_url)
+        
+    Raises:
+        UploadTooLargeError: If image_bytes is larger than MAX_UPLOAD_BYTES.
+            Storage would only reject it after the whole body was sent.
     """
-    # Generate a unique filename if not provided
+    # Only PNGs are re-encoded; JPEG and WebP output was asked for explicitly
+    # and is already lossy, so it is stored as returned
+    content_type, ext = _image_type(image_bytes)
+    if STORE_AS_WEBP and image_bytes[:8] == b"\x89PNG\r\n\x1a\n":
+        try:
+            image_bytes = await asyncio.to_thread(_to_webp_bytes, image_bytes)
+            content_type, ext = "image/webp", ".webp"
+        except OSError as e:
+            logger.warning("Could not re-encode image as WebP, storing it unchanged: %s", e)
+    
+    if len(image_bytes) > MAX_UPLOAD_BYTES:
+        raise UploadTooLargeError(f"Image exceeds {MAX_UPLOAD_BYTES} bytes")
+    
+    # Generate a unique filename if not provided; a given one gets the extension
+    # of the format actually stored, which may have changed to WebP
     if not filename:
-        ext = ".png"  # Default extension
-        filename = f"{folder}_{uuid.uuid4()}{ext}"
+        filename = f"{folder}_{uuid.uuid4().hex}{ext}"
+    else:
+        filename = os.path.splitext(filename)[0] + ext
         
-    # Path within the bucket
+    # Path within the bucket; the public URL follows from it without a round-trip
     storage_path = f"{folder}/{filename}"
+    public_url = _public_url(storage_path)
+    
+    # Store metadata in database if we have the DB module imported. The URL is
+    # already known, so the insert runs in the background alongside the upload
+    metadata_task = None
+    if insert_image_metadata is None:
+        logger.debug("Database module not available, skipping metadata storage")
+    else:
+        metadata_task = asyncio.create_task(
+            insert_image_metadata(
+                image_id=filename,
+                storage_path=storage_path,
+                public_url=public_url,
+                prompt=prompt,
+                ad_text=ad_text,
+                category=category,
+                size=size,
+                is_reference=is_reference,
+                title=title
+            ),
+            name=filename
+        )
+        _bg_tasks.add(metadata_task)
+        metadata_task.add_done_callback(_on_metadata_stored)
     
     try:
-        # Print debug info
-        print(f"Uploading to Supabase bucket: {SUPABASE_BUCKET_NAME}")
-        print(f"Storage path: {storage_path}")
-        
-        # Ensure the folder exists
-        folder_exists = await ensure_folder_exists(folder)
-        if not folder_exists:
-            print(f"Warning: Could not confirm folder '{folder}' exists")
+        logger.debug("Uploading to Supabase bucket %s at %s", SUPABASE_BUCKET_NAME, storage_path)
         
         # Upload the file directly without checking if bucket exists
         # The bucket should already exist in your Supabase project
-        response = supabase.storage.from_(SUPABASE_BUCKET_NAME).upload(
-            storage_path,
-            image_bytes,
-            file_options={"content-type": "image/png"}
-        )
-        
-        print(f"Upload response: {response}")
-        
-        # Get the public URL
-        public_url = supabase.storage.from_(SUPABASE_BUCKET_NAME).get_public_url(storage_path)
+        # The storage client is synchronous, so every call runs in a worker thread
+        async with _upload_sem:
+            if len(image_bytes) >= SUPABASE_RESUMABLE_THRESHOLD:
+                response = await _upload_resumable(storage_path, image_bytes, content_type)
+            else:
+                # The first attempt may have stored the object before failing (e.g. a
+                # read timeout), so retries overwrite instead of hitting a duplicate
+                response = await _with_retry(
+                    supabase.storage.from_(SUPABASE_BUCKET_NAME).upload,
+                    storage_path,
+                    image_bytes,
+                    file_options={"content-type": content_type},
+                    retry_kwargs={"file_options": {"content-type": content_type, "x-upsert": "true"}}
+                )
         
-        print(f"Public URL: {public_url}")
+        # Skip formatting the response entirely unless debug logging is on
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Upload response: %s", response)
         
-        # Store metadata in database if we have the DB module imported
-        try:
-            from app.supabase_db import insert_image_metadata
-            
-            if public_url:
-                await insert_image_metadata(
-                    image_id=filename,
-                    storage_path=storage_path,
-                    public_url=public_url,
-                    prompt=prompt,
-                    ad_text=ad_text,
-                    category=category,
-                    size=size,
-                    is_reference=is_reference,
-                    title=title
-                )
-                print(f"Stored metadata for {filename} in database")
-        except ImportError:
-            print("Database module not available, skipping metadata storage")
-        except Exception as db_error:
-            print(f"Error storing metadata: {str(db_error)}")
-            traceback.print_exc()
+        logger.debug("Public URL: %s", public_url)
+        _list_cache.clear()
         
         return filename, public_url
     except Exception as e:
-        print(f"Error uploading to Supabase: {str(e)}")
-        traceback.print_exc()
+        logger.exception("Error uploading to Supabase: %s", e)
+        
+        # The metadata row points at an object that was never stored
+        if metadata_task is not None:
+            cleanup_task = asyncio.create_task(_discard_metadata(metadata_task, filename))
+            _bg_tasks.add(cleanup_task)
+            cleanup_task.add_done_callback(_bg_tasks.discard)
         
         # Fall back to local storage for now to ensure functionality
-        print("Falling back to local storage")
-        return upload_local(image_bytes, folder, filename)
+        logger.warning("Falling back to local storage")
+        return await upload_local_async(image_bytes, folder, filename)
+
+# Upload several images at once
+async def upload_images_bulk(items, return_exceptions=False):
+    """
+    Upload several images concurrently; the storage concurrency cap still applies.
+    
+    Args:
+        items (list): Keyword arguments for upload_image, one dict per image
+        return_exceptions (bool): Return failed uploads as exceptions in the
+            result list instead of raising the first one
+        
+    Returns:
+        list: (filename, public_url) tuples in the same order as items
+    """
+    return await asyncio.gather(
+        *[upload_image(**item) for item in items],
+        return_exceptions=return_exceptions
+    )
+
+# Local folders already created by this process
+_local_folders = set()
+
+def ensure_local_folder(folder):
+    """Create static/<folder> once per process instead of on every fallback upload."""
+    if folder not in _local_folders:
+        os.makedirs(f"static/{folder}", exist_ok=True)
+        _local_folders.add(folder)
 
 # Upload an image to local storage (fallback)
-def upload_local(image_bytes, folder="generated", filename=None):
-    """Fallback function to save image locally if Supabase upload fails."""
+async def upload_local_async(image_bytes, folder="generated", filename=None):
+    """Fallback function to save image locally if Supabase upload fails, writing off the event loop."""
     try:
         # Generate a unique filename if not provided
         if not filename:
-            ext = ".png"  # Default extension
-            filename = f"{folder}_{uuid.uuid4()}{ext}"
+            filename = f"{folder}_{uuid.uuid4().hex}.png"
         
-        # Ensure directory exists
-        os.makedirs(f"static/{folder}", exist_ok=True)
+        # Ensure directory exists; only the first write to a folder touches the disk
+        if folder not in _local_folders:
+            await asyncio.to_thread(ensure_local_folder, folder)
         
         # Save the image
-        with open(f"static/{folder}/{filename}", "wb") as f:
-            f.write(image_bytes)
+        await write_bytes(f"static/{folder}/{filename}", image_bytes)
         
-        print(f"Saved image locally to static/{folder}/{filename}")
+        logger.debug("Saved image locally to static/%s/%s", folder, filename)
         return filename, f"/static/{folder}/{filename}"
     except Exception as e:
-        print(f"Error in local fallback upload: {str(e)}")
-        traceback.print_exc()
+        logger.exception("Error in local fallback upload: %s", e)
         raise
 
 # Get list of images from a folder
@@ -170,31 +389,33 @@ async def list_images(folder="generated", limit=50):
     Returns:
         list: List of image objects with filename and url
     """
+    cache_key = (folder, limit)
+    cached = _list_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    
     try:
         # List files in the folder
-        response = supabase.storage.from_(SUPABASE_BUCKET_NAME).list(folder)
+        response = await _with_retry(supabase.storage.from_(SUPABASE_BUCKET_NAME).list, folder)
         
-        print(f"List response for folder '{folder}': {response}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("List response for folder '%s': %s", folder, response)
         
         # Limit the number of results
         files = response[:limit] if len(response) > limit else response
         
-        # Get the public URL for each file
-        images = []
-        for file in files:
-            storage_path = f"{folder}/{file['name']}"
-            public_url = supabase.storage.from_(SUPABASE_BUCKET_NAME).get_public_url(storage_path)
-            
-            images.append({
+        images = [
+            {
                 "filename": file['name'],
-                "url": public_url,
+                "url": _public_url(f"{folder}/{file['name']}"),
                 "created_at": file.get('created_at', None)
-            })
-        
+            }
+            for file in files
+        ]
+        _list_cache[cache_key] = images
         return images
     except Exception as e:
-        print(f"Error listing images from Supabase: {str(e)}")
-        traceback.print_exc()
+        logger.exception("Error listing images from Supabase: %s", e)
         # Return empty list on error
         return []
 
@@ -207,27 +428,43 @@ async def delete_image(filename, folder="generated"):
         filename (str): The filename to delete
         folder (str): The folder containing the image
         
+    Returns:
+        bool: True if successful, False otherwise
+    """
+    return await delete_images([filename], folder)
+
+# Delete several images at once
+async def delete_images(filenames, folder="generated"):
+    """
+    Delete images from Supabase storage in a single request.
+
+    Args:
+        filenames (list): The filenames to delete
+        folder (str): The folder containing the images
+
     Returns:
         bool: True if successful, False otherwise
     """
     try:
-        # Path within the bucket
-        storage_path = f"{folder}/{filename}"
-        
-        # Delete the file
-        supabase.storage.from_(SUPABASE_BUCKET_NAME).remove([storage_path])
-        
+        # Paths within the bucket
+        storage_paths = [f"{folder}/{filename}" for filename in filenames]
+
+        # Delete all files with one request
+        async with _upload_sem:
+            await _with_retry(supabase.storage.from_(SUPABASE_BUCKET_NAME).remove, storage_paths)
+        _list_cache.clear()
+
         # Also delete metadata if possible
-        try:
-            from app.supabase_db import delete_image_metadata
-            await delete_image_metadata(filename)
-        except ImportError:
-            pass  # Ignore if DB module is not available
-        except Exception as db_error:
-            print(f"Error deleting metadata: {str(db_error)}")
-        
+        if delete_image_metadata is not None:
+            results = await asyncio.gather(
+                *[delete_image_metadata(filename) for filename in filenames],
+                return_exceptions=True
+            )
+            for filename, result in zip(filenames, results):
+                if isinstance(result, Exception):
+                    logger.error("Error deleting metadata for %s: %s", filename, result)
+
         return True
     except Exception as e:
-        print(f"Error deleting image from Supabase: {str(e)}")
-        traceback.print_exc()
+        logger.exception("Error deleting images from Supabase: %s", e)
         return False
@@ -0,0 +1,10 @@
+-- Trigram indexes backing search_images in app/supabase_db.py.
+-- GIN trigram indexes serve ILIKE '%term%' lookups directly, so the
+-- leading-wildcard search no longer scans the whole table.
+create extension if not exists pg_trgm;
+
+create index if not exists image_metadata_prompt_trgm
+    on image_metadata using gin (prompt gin_trgm_ops);
+
+create index if not exists image_metadata_ad_text_trgm
+    on image_metadata using gin (ad_text gin_trgm_ops);
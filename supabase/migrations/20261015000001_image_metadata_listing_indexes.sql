@@ -0,0 +1,10 @@
+-- Indexes backing the library list queries in app/supabase_db.py.
+
+-- get_images_by_category: filter on category, newest first, LIMIT n
+create index if not exists image_metadata_category_created_at
+    on image_metadata (category, created_at desc);
+
+-- get_all_images(include_reference=False): newest non-reference images
+create index if not exists image_metadata_generated_created_at
+    on image_metadata (created_at desc)
+    where is_reference = false;
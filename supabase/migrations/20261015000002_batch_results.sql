@@ -0,0 +1,8 @@
+-- Results of completed OpenAI batches, shared by all API workers so each
+-- batch's images are uploaded to storage once (see app/batch_gen.py).
+-- A row with null results is a claim by the worker collecting the batch.
+create table if not exists batch_results (
+    batch_id text primary key,
+    results jsonb,
+    claimed_at timestamptz not null default now()
+);